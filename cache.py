@@ -0,0 +1,215 @@
+import os
+import re
+import glob
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def data_fingerprint(*paths: str, extra: tuple = ()) -> str:
+    """
+    Hash corto del contenido de los archivos (datos, prompts) y de los valores de extra
+    (modelos). Si cambia cualquiera de ellos las respuestas cacheadas dejan de ser válidas.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(path.encode())
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                h.update(f.read())
+    for value in extra:
+        h.update(str(value).encode())
+    return h.hexdigest()[:16]
+
+
+class SemanticCache:
+    """Caché de respuestas en dos niveles: coincidencia exacta (LRU) y similitud semántica."""
+
+    def __init__(
+        self,
+        embed_model,
+        cache_dir: str,
+        fingerprint: str,
+        threshold: float = 0.95,
+        maxsize: int = 1024,
+        max_semantic: int = 1024,
+    ):
+        """
+        embed_model: modelo de embeddings ya cargado (Settings.embed_model)
+        cache_dir: directorio donde se persiste la caché
+        fingerprint: data_fingerprint de los datos y modelos; da nombre al archivo pickle
+        threshold: similitud coseno mínima para considerar un acierto semántico
+        maxsize: número máximo de entradas en el nivel exacto
+        max_semantic: número máximo de entradas por agente en el nivel semántico
+        """
+        self.embed_model = embed_model
+        self.path = os.path.join(cache_dir, f"response_cache_{fingerprint}.pkl")
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.max_semantic = max_semantic
+        # get/put se ejecutan en hilos (asyncio.to_thread) desde varias sesiones a la vez
+        self._lock = threading.Lock()
+        # La escritura a disco va fuera de _lock; _save_lock solo ordena las escrituras
+        self._save_lock = threading.Lock()
+        self._version = 0
+        self._saved_version = 0
+
+        self._exact: OrderedDict[str, str] = OrderedDict()
+        # Un bloque preasignado de max_semantic vectores (normalizados) por agente, usado
+        # como buffer circular: insertar es O(1) y la memoria queda acotada
+        self._vecs: dict[str, np.ndarray] = {}
+        self._sizes: dict[str, int] = {}
+        self._next: dict[str, int] = {}
+        self._responses: dict[str, list[str]] = {}
+        # Los ids (O0001, C001, ...) deben coincidir exactamente aunque los embeddings sean parecidos
+        self._ids: dict[str, list[tuple[str, ...]]] = {}
+        self._load()
+        self._remove_stale_files()
+
+    @staticmethod
+    def _normalize(user_input: str) -> str:
+        return " ".join(user_input.lower().split())
+
+    @staticmethod
+    def _extract_ids(user_input: str) -> tuple[str, ...]:
+        return tuple(sorted(re.findall(r"\w*\d+\w*", user_input.upper())))
+
+    def _key(self, agent_choice: str, user_input: str) -> str:
+        return f"{agent_choice}\x00{self._normalize(user_input)}"
+
+    def _embed(self, user_input: str) -> np.ndarray:
+        q = np.asarray(self.embed_model.get_query_embedding(user_input), dtype=np.float32)
+        return q / (np.linalg.norm(q) + 1e-12)
+
+    def get(self, agent_choice: str, user_input: str):
+        """
+        Busca una respuesta cacheada.
+
+        Returns:
+            (respuesta o None, embedding de la consulta o None). En un fallo el embedding
+            se devuelve para pasarlo a put y no calcularlo dos veces.
+        """
+        key = self._key(agent_choice, user_input)
+        with self._lock:
+            if key in self._exact:
+                self._exact.move_to_end(key)
+                return self._exact[key], None
+
+        q = self._embed(user_input)
+        ids = self._extract_ids(user_input)
+        with self._lock:
+            size = self._sizes.get(agent_choice, 0)
+            if not size:
+                return None, q
+            sims = self._vecs[agent_choice][:size] @ q
+            best = int(sims.argmax())
+            if sims[best] <= self.threshold or self._ids[agent_choice][best] != ids:
+                return None, q
+            response = self._responses[agent_choice][best]
+            self._put_exact(key, response)
+        return response, q
+
+    def put(self, agent_choice: str, user_input: str, response: str, embedding=None):
+        """Guarda una respuesta en ambos niveles y persiste la caché en disco."""
+        q = self._embed(user_input) if embedding is None else embedding
+        with self._lock:
+            self._put_exact(self._key(agent_choice, user_input), response)
+
+            if agent_choice not in self._vecs:
+                self._vecs[agent_choice] = np.zeros((self.max_semantic, q.shape[0]), dtype=np.float32)
+                self._sizes[agent_choice] = 0
+                self._next[agent_choice] = 0
+                self._responses[agent_choice] = []
+                self._ids[agent_choice] = []
+
+            # Con el bloque lleno se reemplaza la entrada más antigua
+            slot = self._next[agent_choice]
+            self._vecs[agent_choice][slot] = q
+            entry_ids = self._extract_ids(user_input)
+            if slot < len(self._responses[agent_choice]):
+                self._responses[agent_choice][slot] = response
+                self._ids[agent_choice][slot] = entry_ids
+            else:
+                self._responses[agent_choice].append(response)
+                self._ids[agent_choice].append(entry_ids)
+            self._next[agent_choice] = (slot + 1) % self.max_semantic
+            self._sizes[agent_choice] = min(self._sizes[agent_choice] + 1, self.max_semantic)
+            self._version += 1
+            snapshot = self._snapshot()
+        self._save(snapshot)
+
+    def _put_exact(self, key: str, response: str):
+        self._exact[key] = response
+        self._exact.move_to_end(key)
+        if len(self._exact) > self.maxsize:
+            self._exact.popitem(last=False)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+            exact = data["exact"]
+            sizes, nexts, responses, ids = {}, {}, {}, {}
+            # En disco solo están las filas usadas: se copian a un bloque de tamaño completo
+            vecs = {}
+            for agent, rows in data["vecs"].items():
+                size = data["sizes"][agent]
+                if not (rows.shape[0] == size == len(data["responses"][agent]) == len(data["ids"][agent])):
+                    return
+                # Un pickle guardado con un max_semantic mayor se descarta
+                if size > self.max_semantic:
+                    return
+                vecs[agent] = np.zeros((self.max_semantic, rows.shape[1]), dtype=np.float32)
+                vecs[agent][:size] = rows
+                sizes[agent] = size
+                # Sin llenar, la siguiente fila libre es size (aunque cambie max_semantic)
+                nexts[agent] = (size if size < self.max_semantic else data["next"][agent]) % self.max_semantic
+                responses[agent] = data["responses"][agent]
+                ids[agent] = data["ids"][agent]
+        except Exception:
+            return
+        self._exact = exact
+        self._vecs = vecs
+        self._sizes = sizes
+        self._next = nexts
+        self._responses = responses
+        self._ids = ids
+
+    def _remove_stale_files(self):
+        """Elimina los pickles de otros fingerprints (datos o modelos anteriores)."""
+        pattern = os.path.join(os.path.dirname(self.path), "response_cache_*.pkl")
+        for stale_path in glob.glob(pattern):
+            if os.path.abspath(stale_path) != os.path.abspath(self.path):
+                try:
+                    os.remove(stale_path)
+                except OSError:
+                    pass
+
+    def _snapshot(self) -> dict:
+        """Copia del estado para persistirla fuera de _lock (llamar con _lock tomado)."""
+        return {
+            "version": self._version,
+            "exact": OrderedDict(self._exact),
+            "vecs": {agent: v[:self._sizes[agent]].copy() for agent, v in self._vecs.items()},
+            "sizes": dict(self._sizes),
+            "next": dict(self._next),
+            "responses": {agent: list(r) for agent, r in self._responses.items()},
+            "ids": {agent: list(i) for agent, i in self._ids.items()},
+        }
+
+    def _save(self, snapshot: dict):
+        with self._save_lock:
+            # Otro hilo ya escribió un estado más reciente
+            if snapshot["version"] <= self._saved_version:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # Escribir a un temporal y reemplazar: un corte a mitad no deja un pickle corrupto
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+            self._saved_version = snapshot["version"]
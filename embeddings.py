@@ -0,0 +1,118 @@
+import os
+import asyncio
+from typing import List
+import numpy as np
+import onnxruntime as ort
+from transformers import AutoTokenizer
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+
+QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def export_quantized_model(model_name: str, export_dir: str) -> str:
+    """
+    Exporta el modelo de HuggingFace a ONNX y lo cuantiza a INT8 (dinámico).
+    Si ya existe una exportación en export_dir, se reutiliza.
+
+    Returns:
+        Ruta al archivo .onnx cuantizado.
+    """
+    quantized_path = os.path.join(export_dir, QUANTIZED_FILE)
+    if os.path.exists(quantized_path):
+        return quantized_path
+
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    model.save_pretrained(export_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(export_dir)
+
+    quantizer = ORTQuantizer.from_pretrained(model)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=export_dir, quantization_config=qconfig)
+    return quantized_path
+
+
+class ONNXEmbedding(BaseEmbedding):
+    """Embeddings de sentence-transformers ejecutados con ONNX Runtime (INT8) en CPU."""
+
+    max_length: int = 256
+    normalize: bool = True
+    bucket_size: int = 32
+
+    _session: ort.InferenceSession = PrivateAttr()
+    _tokenizer = PrivateAttr()
+    _input_names: set = PrivateAttr()
+
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        export_dir: str = "./models/all-MiniLM-L6-v2-onnx-int8",
+        embed_batch_size: int = 256,
+        **kwargs,
+    ):
+        super().__init__(model_name=model_name, embed_batch_size=embed_batch_size, **kwargs)
+        model_path = export_quantized_model(model_name, export_dir)
+
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = os.cpu_count()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self._session = ort.InferenceSession(
+            model_path, sess_options, providers=["CPUExecutionProvider"]
+        )
+        self._tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self._input_names = {i.name for i in self._session.get_inputs()}
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "ONNXEmbedding"
+
+    def _run(self, encoded) -> List[List[float]]:
+        inputs = {k: np.asarray(v, dtype=np.int64) for k, v in encoded.items() if k in self._input_names}
+        last_hidden_state = self._session.run(None, inputs)[0]
+
+        # Mean pooling sobre los tokens reales (ignora el padding)
+        mask = np.asarray(encoded["attention_mask"])[..., None].astype(np.float32)
+        embeddings = (last_hidden_state * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.tolist()
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        encoded = self._tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.max_length,
+            return_tensors="np",
+        )
+        return self._run(encoded)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        # La inferencia es CPU: en un hilo para no bloquear el event loop
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # Tokenizar una sola vez sin padding y agrupar por longitud en tokens:
+        # cada sub-batch solo se rellena hasta su secuencia más larga
+        encoded = self._tokenizer(texts, max_length=self.max_length, truncation=True, padding=False)
+        lengths = [len(ids) for ids in encoded["input_ids"]]
+        order = sorted(range(len(texts)), key=lengths.__getitem__)
+
+        embeddings: List[List[float]] = [None] * len(texts)
+        for start in range(0, len(order), self.bucket_size):
+            idxs = order[start:start + self.bucket_size]
+            features = [{k: encoded[k][i] for k in encoded.keys()} for i in idxs]
+            batch = self._tokenizer.pad(features, padding="longest", return_tensors="np")
+            for i, emb in zip(idxs, self._run(batch)):
+                embeddings[i] = emb
+        return embeddings
@@ -0,0 +1,66 @@
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+
+# Palabras vacías en español (sin tildes, igual que el texto tras strip_accents) más los
+# verbos auxiliares con los que empiezan las preguntas ("puedo", "debo", "quiero"...)
+SPANISH_STOP_WORDS = """
+a al algo algun alguna algunas alguno algunos ante antes como con contra cual cuales
+cuan cuando cuanto de del desde donde durante e el ella ellas ellos en entre era es esa
+esas ese eso esos esta estan estas este esto estos fue ha hay la las le les lo los mas
+me mi mis muy no nos o os para pero por que se si sin sobre su sus tambien te tengo ti
+tu tus un una uno unos unas y ya yo puedo puede pueden hacer hago debo quiero tienen
+""".split()
+
+
+class FAQMatcher:
+    """Búsqueda TF-IDF sobre las preguntas del FAQ para responder sin consultar al LLM."""
+
+    def __init__(
+        self,
+        questions: list[str],
+        answers: list[str],
+        threshold: float = 0.6,
+        margin: float = 0.15,
+    ):
+        """
+        questions: preguntas del FAQ
+        answers: respuesta de cada pregunta (mismo orden)
+        threshold: similitud coseno mínima para devolver la respuesta directamente
+        margin: ventaja mínima de la mejor pregunta sobre la segunda
+        """
+        self.answers = answers
+        self.threshold = threshold
+        self.margin = margin
+        self.vectorizer = TfidfVectorizer(
+            ngram_range=(1, 2),
+            strip_accents="unicode",
+            stop_words=SPANISH_STOP_WORDS,
+            sublinear_tf=True,
+        )
+        self.matrix = self.vectorizer.fit_transform(questions)
+        self._analyzer = self.vectorizer.build_analyzer()
+        self._question_terms = [self._terms(q) for q in questions]
+
+    def _terms(self, text: str) -> set[str]:
+        """Palabras con contenido (sin stop words ni bigramas) del texto."""
+        return {t for t in self._analyzer(text) if " " not in t}
+
+    def scores(self, user_input: str) -> np.ndarray:
+        """Similitud coseno de la consulta con cada pregunta."""
+        return (self.vectorizer.transform([user_input]) @ self.matrix.T).toarray()[0]
+
+    def match(self, user_input: str):
+        """
+        Devuelve la respuesta de la pregunta más parecida, o None si no es una coincidencia clara.
+        Todas las palabras de la consulta deben aparecer en la pregunta: "¿Puedo devolver
+        tarjetas de regalo?" no es "¿Ecomarket ofrece tarjetas de regalo?" aunque compartan
+        casi todo el peso TF-IDF.
+        """
+        scores = self.scores(user_input)
+        best, second = np.argsort(-scores)[:2]
+        if scores[best] <= self.threshold or scores[best] - scores[second] < self.margin:
+            return None
+        if not self._terms(user_input) <= self._question_terms[best]:
+            return None
+        return self.answers[int(best)]
@@ -1,18 +1,40 @@
 import os
-import csv
+import re
 import json
+import asyncio
+import logging
 import pandas as pd
 from dotenv import load_dotenv
 from llama_index.core import VectorStoreIndex, StorageContext, Settings, Document
-from llama_index.core.agent import ReActAgent
+from llama_index.core.schema import TextNode, MetadataMode, NodeRelationship, QueryBundle
+from llama_index.core.agent import FunctionCallingAgentWorker
+from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.llms.openai import OpenAI
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 import pdfplumber
-import tiktoken
+import torch
 import gradio as gr
-from tools import Tools
+from tools import Tools, normalize_pedidos
+from cache import SemanticCache, data_fingerprint
+from faq_matcher import FAQMatcher
+from embeddings import ONNXEmbedding
+from qdrant_repository import (
+    QUANTIZATION_CONFIG,
+    BatchedRetriever,
+    BatchedSearcher,
+    collection_fingerprint,
+    collection_is_populated,
+    dense_vector_config,
+    drop_stale_collections,
+    versioned_collection_name,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ids de pedido tipo O0001
+_ORDER_RE = re.compile(r"\bO\d{3,}\b", re.I)
 
 # === Load .env ===
 load_dotenv()
@@ -22,33 +44,33 @@ if not OPENAI_API_KEY:
 
 # === READERS ===
 
-class CSVReader:
-    def __init__(self, file_path):
-        self.file_path = file_path
+class DataFrameReader:
+    def __init__(self, df):
+        self.df = df
 
     def load_data(self):
         documents = []
-        with open(self.file_path, newline="", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                text = (
-                    f"El id del pedido es {row['order_id']}, Cliente ID: {row['customer_id']}, "
-                    f"Producto: {row['product']}, Categoría: {row['category']}, "
-                    f"Cantidad: {row['quantity']}, Precio: {row['price']}, "
-                    f"Fecha: {row['order_date']}, Estado: {row['estado']}"
-                )
-                metadata = {
-                    "order_id": row["order_id"],
-                    "customer_id": row["customer_id"],
-                    "product": row["product"],
-                    "category": row["category"],
-                    "price": row["price"],
-                    "quantity": row["quantity"],
-                    "order_date": row["order_date"],
-                    "payment_method": row["payment_method"],
-                    "estado": row["estado"]
-                }
-                documents.append(Document(text=text, metadata=metadata))
+        for row in self.df.to_dict("records"):
+            # Con dtype_backend="pyarrow" la fecha llega como datetime.date (date32)
+            order_date = pd.Timestamp(row["order_date"]).date().isoformat()
+            text = (
+                f"El id del pedido es {row['order_id']}, Cliente ID: {row['customer_id']}, "
+                f"Producto: {row['product']}, Categoría: {row['category']}, "
+                f"Cantidad: {row['quantity']}, Precio: {row['price']}, "
+                f"Fecha: {order_date}, Estado: {row['estado']}"
+            )
+            metadata = {
+                "order_id": str(row["order_id"]),
+                "customer_id": str(row["customer_id"]),
+                "product": str(row["product"]),
+                "category": str(row["category"]),
+                "price": str(row["price"]),
+                "quantity": str(row["quantity"]),
+                "order_date": order_date,
+                "payment_method": str(row["payment_method"]),
+                "estado": str(row["estado"])
+            }
+            documents.append(Document(text=text, metadata=metadata))
         return documents
 
 class JSONReader:
@@ -61,24 +83,86 @@ class JSONReader:
             data = json.load(f)
             for item in data:
                 text = f"Pregunta: {item['question']} -> Respuesta: {item['answer']}"
-                documents.append(Document(text=text))
+                # La metadata solo la usa FAQMatcher; no se embebe ni se envía al LLM
+                metadata = {"question": item["question"], "answer": item["answer"]}
+                documents.append(Document(
+                    text=text,
+                    metadata=metadata,
+                    excluded_embed_metadata_keys=list(metadata),
+                    excluded_llm_metadata_keys=list(metadata)
+                ))
         return documents
 
 # === Load data ===
-# Cargar CSV de pedidos para RAG
-csv_docs = CSVReader("./data/pedidos/pedidos.csv").load_data()
+# Cargar CSV de pedidos una sola vez (DataFrame compartido por RAG y Tools)
+pedidos_df = pd.read_csv(
+    "./data/pedidos/pedidos.csv",
+    engine="pyarrow",
+    dtype_backend="pyarrow",
+    parse_dates=["order_date"]
+)
+
+# Documentos para RAG, con el texto original (antes de normalizar)
+csv_docs = DataFrameReader(pedidos_df).load_data()
 
-# Cargar CSV de pedidos para Tools (DataFrame)
-pedidos_df = pd.read_csv("./data/pedidos/pedidos.csv")
+# Normalizar en el mismo DataFrame para Tools
+normalize_pedidos(pedidos_df)
 
 # Cargar FAQ
 json_docs = JSONReader("./data/faq/faq.json").load_data()
 
+# === Set up OpenAI LLM and embeddings ===
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_DIM = 384
+llm = OpenAI(model="gpt-4o-mini", openai_api_key=OPENAI_API_KEY, temperature=0)
+Settings.llm = llm
+# GPU: FP16 con PyTorch. CPU: modelo ONNX cuantizado a INT8
+if torch.cuda.is_available():
+    embed_model = HuggingFaceEmbedding(
+        model_name=EMBED_MODEL_NAME,
+        device="cuda",
+        model_kwargs={"torch_dtype": torch.float16},
+        embed_batch_size=64
+    )
+else:
+    embed_model = ONNXEmbedding(
+        model_name=EMBED_MODEL_NAME,
+        embed_batch_size=256
+    )
+Settings.embed_model = embed_model
+
 # === Initialize Qdrant ===
-qdrant_client = QdrantClient(url="http://localhost:6333")
+qdrant_client = QdrantClient(host="localhost", grpc_port=6334, prefer_grpc=True)
+aqdrant_client = AsyncQdrantClient(host="localhost", grpc_port=6334, prefer_grpc=True)
+collection_docs = {"pedidos": csv_docs, "faq": json_docs}
+
+# Reutilizar las colecciones ya pobladas; recrear solo las vacías o desactualizadas
+# El nombre de cada colección lleva el hash de su contenido: si cambian los datos, el modelo
+# (incluido el backend: FP16 en GPU o INT8 ONNX en CPU) o la cuantización, el nombre cambia y se
+# crea una colección nueva en vez de reutilizar la vieja
+collection_names = {}
+reuse_collection = {}
+for agent_name, docs in collection_docs.items():
+    fingerprint = collection_fingerprint(docs, extra=(EMBED_MODEL_NAME, EMBED_DIM, type(embed_model).__name__))
+    collection_name = versioned_collection_name(agent_name, fingerprint)
+    collection_names[agent_name] = collection_name
+    reuse_collection[agent_name] = collection_is_populated(qdrant_client, collection_name, len(docs))
+    if not reuse_collection[agent_name] and qdrant_client.collection_exists(collection_name):
+        # Colección a medio poblar: el vector store la vuelve a crear al indexar
+        qdrant_client.delete_collection(collection_name)
+    drop_stale_collections(qdrant_client, agent_name, keep=collection_name)
+
+# QdrantVectorStore crea las colecciones nuevas con cuantización INT8, HNSW en RAM y el
+# índice de payload sobre doc_id
 agents_collections = {
-    "pedidos": QdrantVectorStore(collection_name="pedidos", client=qdrant_client),
-    "faq": QdrantVectorStore(collection_name="faq", client=qdrant_client),
+    agent_name: QdrantVectorStore(
+        collection_name=collection_name,
+        client=qdrant_client,
+        aclient=aqdrant_client,
+        dense_config=dense_vector_config(EMBED_DIM),
+        quantization_config=QUANTIZATION_CONFIG,
+    )
+    for agent_name, collection_name in collection_names.items()
 }
 
 storage_contexts = {
@@ -86,11 +170,18 @@ storage_contexts = {
     for agent, vector_store in agents_collections.items()
 }
 
-# === Set up OpenAI LLM and embeddings ===
-llm = OpenAI(model="gpt-4o-mini", openai_api_key=OPENAI_API_KEY, temperature=0)
-Settings.llm = llm
-embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
-Settings.embed_model = embed_model
+# === Response cache (solo agentes RAG; devoluciones mantiene estado de conversación) ===
+CACHEABLE_AGENTS = ("pedidos", "faq")
+# El archivo depende de los datos, prompts y modelos: si cambian, se empieza con caché vacía.
+# Fuera de ./qdrant_storage, que es el volumen de Qdrant
+cache_fingerprint = data_fingerprint(
+    "./data/pedidos/pedidos.csv",
+    "./data/faq/faq.json",
+    "./prompts/pedidos.txt",
+    "./prompts/faq.txt",
+    extra=(llm.model, embed_model.model_name, type(embed_model).__name__),
+)
+response_cache = SemanticCache(embed_model, cache_dir="./cache", fingerprint=cache_fingerprint)
 
 # === Load system prompts ===
 def load_system_prompt(agent_name: str) -> str:
@@ -108,78 +199,183 @@ system_prompts = {
 }
 
 # === Create indices (solo para pedidos y FAQ) ===
+def build_nodes(docs):
+    """Calcula los embeddings de todos los documentos en un solo batch y devuelve TextNodes."""
+    texts = [d.get_content(metadata_mode=MetadataMode.EMBED) for d in docs]
+    # Ordenar por longitud para que cada batch solo rellene hasta su texto más largo
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    sorted_embs = embed_model.get_text_embedding_batch([texts[i] for i in order], show_progress=True)
+    embs = [None] * len(texts)
+    for pos, i in enumerate(order):
+        embs[i] = sorted_embs[pos]
+    return [
+        TextNode(
+            text=d.text,
+            metadata=d.metadata,
+            excluded_embed_metadata_keys=d.excluded_embed_metadata_keys,
+            excluded_llm_metadata_keys=d.excluded_llm_metadata_keys,
+            # Igual que from_documents: el payload guarda doc_id/ref_doc_id del documento origen
+            relationships={NodeRelationship.SOURCE: d.as_related_node_info()},
+            embedding=emb
+        )
+        for d, emb in zip(docs, embs)
+    ]
+
+
 indexes = {}
-for agent_name, docs in [("pedidos", csv_docs), ("faq", json_docs)]:
-    indexes[agent_name] = VectorStoreIndex.from_documents(
-        docs,
-        storage_context=storage_contexts[agent_name],
-        embed_model=embed_model
+for agent_name, docs in collection_docs.items():
+    if reuse_collection[agent_name]:
+        indexes[agent_name] = VectorStoreIndex.from_vector_store(
+            agents_collections[agent_name],
+            embed_model=embed_model
+        )
+    else:
+        indexes[agent_name] = VectorStoreIndex(
+            build_nodes(docs),
+            storage_context=storage_contexts[agent_name],
+            embed_model=embed_model
+        )
+
+# Query engines construidos una sola vez y reutilizados en cada turno. Las búsquedas de varias
+# sesiones concurrentes se agrupan en un search_batch sobre gRPC, con rescore de la cuantización
+searchers = {
+    name: BatchedSearcher(aqdrant_client, embed_model, collection_name=collection_names[name])
+    for name in ("pedidos", "faq")
+}
+query_engines = {
+    name: RetrieverQueryEngine.from_args(
+        BatchedRetriever(searchers[name]),
+        llm=llm,
+        response_mode="compact",
+        system_prompt=system_prompts[name],
+        streaming=True
     )
+    for name in ("pedidos", "faq")
+}
+
+# FAQ: coincidencia TF-IDF sobre las preguntas antes de recurrir al query engine
+faq_matcher = FAQMatcher(
+    questions=[d.metadata["question"] for d in json_docs],
+    answers=[d.metadata["answer"] for d in json_docs]
+)
+
+# Búsquedas directas por id de pedido: metadata original (sin normalizar) de cada documento
+pedidos_by_id = {d.metadata["order_id"]: d.metadata for d in csv_docs}
 
 # === Create Tools for Devoluciones Agent ===
 tools_manager = Tools(pedidos_df)
 devoluciones_tools = tools_manager.get_tools()
 
 # === Create Devoluciones Agent with Tools ===
-devoluciones_agent = ReActAgent.from_tools(
+# gpt-4o-mini soporta function calling nativo: una llamada al LLM por paso en vez del ciclo ReAct
+devoluciones_worker = FunctionCallingAgentWorker.from_tools(
     tools=devoluciones_tools,
     llm=llm,
     verbose=True,
-    max_iterations=10,
+    max_function_calls=5,
+    allow_parallel_tool_calls=True,
     system_prompt=system_prompts["devoluciones"]
 )
 
 # GRADIO CHAT
-def chat_with_agent(agent_choice, user_input, chat_history):
-    if not user_input:
-        return chat_history
+async def stream_query(query_engine, user_input, query_embedding=None):
+    """
+    Genera la respuesta de un query engine por fragmentos.
+    query_embedding: embedding ya calculado por la caché; así el retriever no vuelve a calcularlo
+    """
+    if query_embedding is not None:
+        user_input = QueryBundle(user_input, embedding=query_embedding.tolist())
+    response = await query_engine.aquery(user_input)
+    if hasattr(response, "async_response_gen"):
+        async for token in response.async_response_gen():
+            yield token
+    else:
+        yield str(response)
 
+
+async def stream_agent(agent_choice, user_input, devoluciones_agent, query_embedding=None):
+    """Genera la respuesta del agente seleccionado por fragmentos."""
     if agent_choice == "devoluciones":
-        try:
-            response = devoluciones_agent.chat(user_input)
-        except Exception as e:
-            response = f"❌ Error en el agente de devoluciones: {str(e)}"
+        # El worker de function calling no soporta streaming: se envía la respuesta completa
+        response = await devoluciones_agent.achat(user_input)
+        yield str(response)
 
     elif agent_choice == "pedidos":
-        try:
-            user_input_upper = user_input.upper()
-            if "O" in user_input_upper and any(char.isdigit() for char in user_input):
-                retriever = indexes["pedidos"].as_retriever(similarity_top_k=3)
-                results = retriever.retrieve(user_input)
-                if results:
-                    pedido_info = results[0].metadata
-                    response = "📦 Información del pedido:\n"
-                    response += "\n".join([f"• {k}: {v}" for k, v in pedido_info.items()])
-                else:
-                    response = "❌ No se encontró información sobre el pedido solicitado."
+        match = _ORDER_RE.search(user_input)
+        if match:
+            # Id exacto: se responde con la metadata del pedido sin consultar Qdrant
+            pedido_info = pedidos_by_id.get(match.group(0).upper())
+            if pedido_info is not None:
+                yield "📦 Información del pedido:\n" + "\n".join([f"• {k}: {v}" for k, v in pedido_info.items()])
             else:
-                query_engine = indexes["pedidos"].as_query_engine(
-                    retriever_mode="embedding",
-                    response_mode="compact",
-                    system_prompt=system_prompts["pedidos"]
-                )
-                response = query_engine.query(user_input)
-        except Exception as e:
-            response = f"❌ Error: {str(e)}"
+                yield "❌ No se encontró información sobre el pedido solicitado."
+        else:
+            async for token in stream_query(query_engines["pedidos"], user_input, query_embedding):
+                yield token
 
     elif agent_choice == "faq":
-        try:
-            query_engine = indexes["faq"].as_query_engine(
-                retriever_mode="embedding",
-                response_mode="compact",
-                system_prompt=system_prompts["faq"]
-            )
-            response = query_engine.query(user_input)
-        except Exception as e:
-            response = f"❌ Error: {str(e)}"
+        answer = faq_matcher.match(user_input)
+        if answer is not None:
+            yield answer
+        else:
+            async for token in stream_query(query_engines["faq"], user_input, query_embedding):
+                yield token
+
     else:
-        response = "❌ Selecciona un agente válido."
-    
-    if not isinstance(response, str):
-        response = str(response)
-    
-    chat_history.append((user_input, response))
-    return chat_history
+        yield "❌ Selecciona un agente válido."
+
+
+async def chat_with_agent(agent_choice, user_input, chat_history, devoluciones_agent):
+    """
+    devoluciones_agent: agente de la sesión (gr.State). Cada sesión tiene su propio agente y
+    su ChatMemoryBuffer: con varias peticiones concurrentes, la memoria (ids de cliente,
+    pedidos) de un usuario no debe mezclarse con la de otro
+    """
+    if devoluciones_agent is None and agent_choice == "devoluciones":
+        devoluciones_agent = devoluciones_worker.as_agent()
+
+    async for history in _chat_with_agent(agent_choice, user_input, chat_history, devoluciones_agent):
+        yield history, devoluciones_agent
+
+
+async def _chat_with_agent(agent_choice, user_input, chat_history, devoluciones_agent):
+    if not user_input:
+        yield chat_history
+        return
+
+    cacheable = agent_choice in CACHEABLE_AGENTS
+    query_embedding = None
+    if cacheable:
+        # El embedding es CPU: fuera del event loop para no bloquear otras sesiones
+        cached, query_embedding = await asyncio.to_thread(response_cache.get, agent_choice, user_input)
+        if cached is not None:
+            chat_history.append((user_input, cached))
+            yield chat_history
+            return
+
+    chat_history.append((user_input, ""))
+    response = ""
+    failed = False
+    try:
+        async for token in stream_agent(agent_choice, user_input, devoluciones_agent, query_embedding):
+            response += token
+            chat_history[-1] = (user_input, response)
+            yield chat_history
+    except Exception as e:
+        failed = True
+        if agent_choice == "devoluciones":
+            response = f"❌ Error en el agente de devoluciones: {str(e)}"
+        else:
+            response = f"❌ Error: {str(e)}"
+        chat_history[-1] = (user_input, response)
+        yield chat_history
+
+    if cacheable and not failed:
+        # La respuesta ya se envió: un error al cachear no debe llegar al usuario
+        try:
+            await asyncio.to_thread(response_cache.put, agent_choice, user_input, response, query_embedding)
+        except Exception:
+            logger.exception("No se pudo guardar la respuesta en la caché")
 
 
 
@@ -200,22 +396,16 @@ with gr.Blocks() as demo:
     chatbox = gr.Chatbot(label="Chat", type="tuples")
     user_input = gr.Textbox(label="Tu mensaje", placeholder="Escribe aquí...")
     submit_btn = gr.Button("Enviar")
+    devoluciones_state = gr.State(None)
 
-
-
-    def wrapped_chat(agent_choice, user_input, chat_history):
-        
-        chat_history = chat_with_agent(agent_choice, user_input, chat_history)
-        
-        return chat_history
-
+    # Handler generador: Gradio envía cada actualización del historial mientras se transmite
     submit_btn.click(
-        wrapped_chat,
-        inputs=[agent_dropdown, user_input, chatbox],
-        outputs=chatbox
+        chat_with_agent,
+        inputs=[agent_dropdown, user_input, chatbox, devoluciones_state],
+        outputs=[chatbox, devoluciones_state]
     )
 
-demo.launch()
+demo.queue(default_concurrency_limit=16, max_size=64).launch()
 
 
 
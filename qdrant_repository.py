@@ -0,0 +1,188 @@
+import re
+import json
+import asyncio
+import hashlib
+from typing import List
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http import models
+from llama_index.core.constants import DEFAULT_SIMILARITY_TOP_K
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+
+
+# Cuantización escalar INT8 con los vectores cuantizados siempre en RAM
+QUANTIZATION_CONFIG = models.ScalarQuantization(
+    scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=True)
+)
+
+# Comparación sobre los vectores INT8 en RAM y re-ranking con los originales. QdrantVectorStore
+# no deja pasar search_params en sus búsquedas, por eso se aplican en BatchedSearcher
+QUANTIZED_SEARCH_PARAMS = models.SearchParams(
+    quantization=models.QuantizationSearchParams(ignore=False, rescore=True, oversampling=2.0)
+)
+
+
+# Versión del formato del payload; subirla obliga a reindexar. 2: nodos con relación SOURCE
+# (doc_id/ref_doc_id del documento origen)
+PAYLOAD_VERSION = 2
+
+
+def collection_fingerprint(docs, extra: tuple = ()) -> str:
+    """
+    Hash corto del contenido de los documentos (texto y metadata), de los valores de extra
+    (modelo de embeddings, dimensión), de la configuración de cuantización y de PAYLOAD_VERSION.
+    """
+    h = hashlib.sha256()
+    for doc in docs:
+        h.update(doc.text.encode())
+        h.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode())
+    for value in extra:
+        h.update(str(value).encode())
+    h.update(QUANTIZATION_CONFIG.model_dump_json().encode())
+    h.update(str(PAYLOAD_VERSION).encode())
+    return h.hexdigest()[:16]
+
+
+def versioned_collection_name(base_name: str, fingerprint: str) -> str:
+    """Nombre físico de la colección: el sufijo cambia cuando cambian los datos o la configuración."""
+    return f"{base_name}_{fingerprint}"
+
+
+def drop_stale_collections(client: QdrantClient, base_name: str, keep: str):
+    """Elimina las versiones anteriores de la colección (incluida la antigua sin sufijo)."""
+    stale_re = re.compile(rf"^{re.escape(base_name)}(_[0-9a-f]{{16}})?$")
+    for collection in client.get_collections().collections:
+        if collection.name != keep and stale_re.match(collection.name):
+            client.delete_collection(collection.name)
+
+
+def collection_is_populated(client: QdrantClient, collection_name: str, expected_count: int) -> bool:
+    """Indica si la colección existe y ya contiene exactamente expected_count puntos."""
+    if not client.collection_exists(collection_name):
+        return False
+    return client.count(collection_name, exact=True).count == expected_count
+
+
+def dense_vector_config(vector_size: int) -> models.VectorParams:
+    """Vectores densos (coseno) con los originales y el índice HNSW en RAM."""
+    return models.VectorParams(
+        size=vector_size,
+        distance=models.Distance.COSINE,
+        on_disk=False,
+        hnsw_config=models.HnswConfigDiff(on_disk=False),
+    )
+
+
+class BatchedSearcher:
+    """
+    Agrupa las búsquedas concurrentes sobre una colección de Qdrant en una sola llamada
+    a search_batch. Cada consulta espera como máximo window_ms a que lleguen otras.
+    """
+
+    def __init__(
+        self,
+        client: AsyncQdrantClient,
+        embed_model,
+        collection_name: str,
+        limit: int = DEFAULT_SIMILARITY_TOP_K,
+        window_ms: int = 20,
+        max_batch: int = 8,
+    ):
+        self.client = client
+        self.embed_model = embed_model
+        self.collection_name = collection_name
+        self.limit = limit
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+
+        # La cola y el worker se crean en el event loop que atiende las peticiones
+        self._queue: asyncio.Queue | None = None
+        self._worker_task: asyncio.Task | None = None
+
+    async def search(self, query: str, embedding=None) -> List[NodeWithScore]:
+        """
+        Busca los nodos más cercanos a la consulta.
+        embedding: embedding ya calculado (p. ej. por la caché); si es None se calcula en el batch
+
+        Returns:
+            Nodos con su similitud, ordenados de mayor a menor.
+        """
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._worker_task = asyncio.create_task(self._worker())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((query, embedding, future))
+        return await future
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _embed_missing(self, batch) -> list:
+        """Embeddings de todo el batch; los que faltan se calculan en una sola llamada."""
+        vectors = [embedding for _, embedding, _ in batch]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            # El embedding es CPU: se ejecuta fuera del event loop
+            embs = await asyncio.to_thread(
+                self.embed_model.get_text_embedding_batch, [batch[i][0] for i in missing]
+            )
+            for i, emb in zip(missing, embs):
+                vectors[i] = emb
+        return [list(map(float, v)) for v in vectors]
+
+    async def _worker(self):
+        while True:
+            batch = await self._collect()
+            try:
+                vectors = await self._embed_missing(batch)
+                results = await self.client.search_batch(
+                    collection_name=self.collection_name,
+                    requests=[
+                        models.SearchRequest(
+                            vector=v,
+                            limit=self.limit,
+                            with_payload=True,
+                            params=QUANTIZED_SEARCH_PARAMS,
+                        )
+                        for v in vectors
+                    ],
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, _, future), points in zip(batch, results):
+                if not future.done():
+                    future.set_result([
+                        NodeWithScore(node=metadata_dict_to_node(p.payload), score=p.score)
+                        for p in points
+                    ])
+
+
+class BatchedRetriever(BaseRetriever):
+    """Retriever para query engines: cada consulta pasa por el BatchedSearcher de su colección."""
+
+    def __init__(self, searcher: BatchedSearcher, **kwargs):
+        self._searcher = searcher
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        # El batch vive en el event loop de Gradio: solo se admite la ruta async (aquery)
+        raise NotImplementedError("BatchedRetriever solo admite consultas async (aquery/aretrieve)")
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return await self._searcher.search(query_bundle.query_str, query_bundle.embedding)
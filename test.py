@@ -1,9 +1,14 @@
 import pandas as pd
-from tools import Tools
+from tools import Tools, normalize_pedidos
 
-df = pd.read_csv('data/pedidos/ecommerce_orders.csv')
+df = pd.read_csv(
+    'data/pedidos/pedidos.csv',
+    engine="pyarrow",
+    dtype_backend="pyarrow",
+    parse_dates=["order_date"]
+)
 
-tools_manager = Tools(df)
+tools_manager = Tools(normalize_pedidos(df))
 tools = tools_manager.get_tools()
 
 print(tools_manager.evaluate_return_eligibility("O0008"))  # Devuelto
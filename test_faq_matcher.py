@@ -0,0 +1,51 @@
+import json
+from faq_matcher import FAQMatcher
+
+with open("data/faq/faq.json", encoding="utf-8") as f:
+    faq = json.load(f)
+
+matcher = FAQMatcher(
+    questions=[item["question"] for item in faq],
+    answers=[item["answer"] for item in faq],
+)
+
+# Paráfrasis que deben responderse directamente con la pregunta indicada
+PARAPHRASES = {
+    "¿cuanto tarda en llegar mi pedido?": "¿Cuánto tarda en llegar un pedido?",
+    "como solicito una devolucion": "¿Cómo solicito una devolución?",
+    "Olvidé mi contraseña": "¿Qué hago si olvidé mi contraseña?",
+    "¿Tienen envíos gratuitos?": "¿Ecomarket ofrece envíos gratuitos?",
+    "quiero cancelar mi pedido": "¿Puedo cancelar un pedido?",
+    "Cómo contacto a servicio al cliente": "¿Cómo contacto al servicio al cliente?",
+}
+
+# Preguntas fuera del FAQ o parecidas a otra: deben ir al LLM (None)
+FALL_THROUGH = [
+    "¿Puedo devolver un producto de higiene?",
+    "¿Cuánto tarda el reembolso?",
+    "¿Puedo cancelar mi suscripción?",
+    "¿Puedo pagar con criptomonedas?",
+    "¿Puedo devolver un producto usado?",
+    "¿Puedo cambiar mi pedido?",
+    "¿Cuál es el horario de atención?",
+    "¿Tienen tienda física en Medellín?",
+    "¿Puedo devolver tarjetas de regalo?",
+    "¿Cuánto tarda en llegar un pedido internacional?",
+]
+
+
+def test_paraphrases_match():
+    answers = {item["question"]: item["answer"] for item in faq}
+    for query, question in PARAPHRASES.items():
+        assert matcher.match(query) == answers[question], query
+
+
+def test_ambiguous_questions_fall_through():
+    for query in FALL_THROUGH:
+        assert matcher.match(query) is None, query
+
+
+if __name__ == "__main__":
+    test_paraphrases_match()
+    test_ambiguous_questions_fall_through()
+    print("✅ FAQMatcher OK")
@@ -0,0 +1,88 @@
+import time
+import datetime
+import pandas as pd
+from tools import Tools, normalize_pedidos
+
+
+def load_pedidos():
+    # Mismos argumentos que main.py: order_date llega como date32 de Arrow
+    return pd.read_csv(
+        "./data/pedidos/pedidos.csv",
+        engine="pyarrow",
+        dtype_backend="pyarrow",
+        parse_dates=["order_date"]
+    )
+
+
+def recent_tools(order_ids: list[str], days_ago: int) -> Tools:
+    """Tools con la fecha de los pedidos movida a hace days_ago días (dentro del plazo)."""
+    df = load_pedidos()
+    dates = df["order_date"].astype(object)
+    dates[df["order_id"].isin(order_ids)] = datetime.date.today() - datetime.timedelta(days=days_ago)
+    df["order_date"] = pd.Series(dates, dtype=df["order_date"].dtype)
+    return Tools(normalize_pedidos(df))
+
+
+tools_manager = Tools(normalize_pedidos(load_pedidos()))
+
+
+def test_normalize_pedidos():
+    df = tools_manager.df
+    assert str(df["order_date"].dtype) == "datetime64[ns]"
+    assert (df["estado"] == df["estado"].str.lower().str.strip()).all()
+    assert (df["category"] == df["category"].str.lower().str.strip()).all()
+    assert df["product"].iloc[0] == "cepillo de dientes de bambú"
+
+
+def test_evaluate_return_eligibility():
+    assert tools_manager.evaluate_return_eligibility("O0008") == "❌ El pedido O0008 ya fue devuelto anteriormente."
+    assert tools_manager.evaluate_return_eligibility("o0053 ").startswith("⚠️ El pedido O0053 aún no ha sido enviado.")
+    assert "categoría 'higiene'" in tools_manager.evaluate_return_eligibility("O0001")
+    assert tools_manager.evaluate_return_eligibility("O0003").startswith("❌ Han pasado")
+    assert tools_manager.evaluate_return_eligibility("O9999") == "❌ No se encontró el pedido O9999 en el sistema."
+
+
+def test_evaluate_return_eligibility_within_period():
+    t = recent_tools(["O0003", "O0006", "O0010"], days_ago=5)
+    assert t.evaluate_return_eligibility("O0010") == (
+        "✅ El pedido O0010 con producto 'zapatillas fibra natural' es elegible para devolución. "
+        "Tiempo desde compra: 5 días. Método de pago: Tarjeta de Crédito. "
+        "Total a reembolsar: $68,000 COP."
+    )
+    assert t.evaluate_return_eligibility("O0006").startswith("✅ Pedido O0006 elegible para devolución, pero requiere revisión manual")
+    assert t.evaluate_return_eligibility("O0003").startswith("⚠️ El producto 'botella reutilizable acero grabada' es personalizado.")
+
+
+def test_search_customer_orders():
+    result = tools_manager.search_customer_orders("c001")
+    assert result.startswith("📦 Pedidos del cliente C001:")
+    assert "• Order ID: O0001" in result
+    assert "Total: $17,000 COP" in result
+    assert tools_manager.search_customer_orders("C999").startswith("❌")
+
+
+def test_initiate_return_request():
+    t = recent_tools(["O0010"], days_ago=5)
+    sent = []
+    # Sin conexión SMTP real: el hilo de correo llama a este _send_mail
+    t._send_mail = sent.append
+
+    assert tools_manager.initiate_return_request("O0001", "a@b.co", "no me gusta").startswith("❌")
+    result = t.initiate_return_request("O0010", "a@b.co", "no me gusta")
+    assert result.startswith("✅ Solicitud de devolución iniciada exitosamente!")
+
+    deadline = time.time() + 2
+    while not sent and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(sent) == 1
+    assert sent[0]["To"] == "a@b.co"
+    assert sent[0]["Subject"] == "Solicitud de Devolución - Pedido O0010"
+
+
+if __name__ == "__main__":
+    test_normalize_pedidos()
+    test_evaluate_return_eligibility()
+    test_evaluate_return_eligibility_within_period()
+    test_search_customer_orders()
+    test_initiate_return_request()
+    print("✅ Tools OK")
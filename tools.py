@@ -1,9 +1,81 @@
+import time
+import queue
+import logging
+import smtplib
 import datetime
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import numpy as np
 import pandas as pd
 from llama_index.core.tools import FunctionTool
 import os
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
+# Intentos de envío por email; entre intentos se reabre la conexión SMTP
+SMTP_MAX_ATTEMPTS = 3
+# Segundos máximos por operación SMTP: si el servidor deja de responder, el socket falla con
+# un OSError (y se reintenta) en vez de bloquear el hilo de correo indefinidamente
+SMTP_TIMEOUT = 30
+
+# Categorías que no admiten devolución por política de la tienda
+CATEGORIAS_NO_DEVOLUCION = ["higiene", "software", "tarjetas de regalo"]
+
+# Tabla de decisión de evaluate_return_eligibility: el índice es el elig_code del pedido.
+# Las reglas se evalúan en este orden; la primera que se cumple define el código.
+ELIG_FUERA_DE_PLAZO = 4
+ELIGIBILITY_TEMPLATES = [
+    # 0. Ya devuelto
+    "❌ El pedido {order_id} ya fue devuelto anteriormente.",
+    # 1. Sin enviar
+    "⚠️ El pedido {order_id} aún no ha sido enviado. Puedes cancelarlo sin iniciar una devolución.",
+    # 2. En tránsito
+    "⚠️ El pedido {order_id} está en tránsito. Espera a recibirlo para iniciar una devolución si es necesario.",
+    # 3. Categoría no elegible para devolución
+    (
+        "❌ El producto '{product}' pertenece a la categoría '{category}', "
+        "que no admite devoluciones por política de la tienda."
+    ),
+    # 4. Más de 30 días desde la compra
+    (
+        "❌ Han pasado {days} días desde la compra (fecha: {order_date}). "
+        "Solo se admiten devoluciones dentro de 30 días."
+    ),
+    # 5. Productos personalizados requieren revisión
+    (
+        "⚠️ El producto '{product}' es personalizado. "
+        "La devolución requiere revisión manual del equipo. "
+        "Tiempo desde compra: {days} días."
+    ),
+    # 6. Método de pago efectivo requiere revisión
+    (
+        "✅ Pedido {order_id} elegible para devolución, pero requiere revisión manual "
+        "por haber sido pagado en efectivo. Producto: '{product}'. "
+        "Tiempo desde compra: {days} días."
+    ),
+    # 7. Elegible sin restricciones
+    (
+        "✅ El pedido {order_id} con producto '{product}' "
+        "es elegible para devolución. "
+        "Tiempo desde compra: {days} días. "
+        "Método de pago: {payment_method}. "
+        "Total a reembolsar: ${total:,.0f} COP."
+    ),
+]
+
+
+def normalize_pedidos(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normaliza en el mismo DataFrame (sin copiarlo) los nombres de columnas, el texto
+    (kernels UTF-8 de Arrow) y la fecha del pedido. Devuelve el mismo DataFrame.
+    """
+    df.columns = [c.lower().strip() for c in df.columns]
+    for col in ("product", "category", "estado"):
+        df[col] = df[col].astype("string[pyarrow]").str.lower().str.strip()
+    df["order_date"] = pd.to_datetime(df["order_date"]).astype("datetime64[ns]")
+    return df
 
 
 class Tools:
@@ -12,18 +84,130 @@ class Tools:
     def __init__(self, pedidos_df: pd.DataFrame):
         load_dotenv()
         """
-        pedidos_df: DataFrame con columnas:
+        pedidos_df: DataFrame ya normalizado con normalize_pedidos, con columnas:
         [order_id, customer_id, product, category, price, quantity, order_date, payment_method, estado]
+        Se comparte sin copiar: las columnas derivadas se agregan sobre el mismo DataFrame.
         """
-        self.df = pedidos_df.copy()
-        # Normalizamos los nombres de columnas y texto
-        self.df.columns = [c.lower().strip() for c in self.df.columns]
-        self.df["product"] = self.df["product"].astype(str).str.lower().str.strip()
-        self.df["category"] = self.df["category"].astype(str).str.lower().str.strip()
-        self.df["estado"] = self.df["estado"].astype(str).str.lower().str.strip()
-        
-        # Convertir order_date a datetime
-        self.df["order_date"] = pd.to_datetime(self.df["order_date"])
+        self.df = pedidos_df
+
+        # Columnas derivadas calculadas una sola vez
+        self.df["total"] = self.df["price"] * self.df["quantity"]
+        self._days_base_date = datetime.date.today()
+        order_days = self.df["order_date"].values.astype("datetime64[D]")
+        self.df["days_since"] = (np.datetime64(self._days_base_date, "D") - order_days).astype(int)
+        self.df["elig_code"] = self._eligibility_codes()
+
+        # Índices hash para búsquedas O(1) por order_id y customer_id
+        self._by_order: dict[str, dict] = {r["order_id"]: r for r in self.df.to_dict("records")}
+        self._by_customer: dict[str, list[int]] = self.df.groupby("customer_id").indices
+        self._today_date = None
+        self._today_expires = 0.0
+
+        # Conexión SMTP persistente: los emails se encolan y un hilo los envía
+        self._smtp = None
+        self._mail_q: queue.Queue = queue.Queue()
+        threading.Thread(target=self._mail_worker, daemon=True).start()
+
+    def _eligibility_codes(self) -> np.ndarray:
+        """Calcula el código de ELIGIBILITY_TEMPLATES de cada pedido de forma vectorizada."""
+        def mask(series) -> np.ndarray:
+            return series.fillna(False).to_numpy(dtype=bool)
+
+        estado = self.df["estado"]
+        categoria = self.df["category"]
+        pago = self.df["payment_method"].astype("string[pyarrow]").str.lower().str.strip()
+        conditions = [
+            mask(estado == "devuelto"),
+            mask(estado == "sin enviar"),
+            mask(estado == "enviado"),
+            mask(categoria.isin(CATEGORIAS_NO_DEVOLUCION)),
+            self.df["days_since"].to_numpy() > 30,
+            mask(categoria == "personalizado"),
+            mask(pago == "efectivo"),
+        ]
+        return np.select(conditions, list(range(len(conditions))), default=len(conditions))
+
+    def _smtp_connect(self):
+        server = smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=SMTP_TIMEOUT)
+        server.login(os.getenv("EMAIL"), os.getenv("PASSWORD"))
+        return server
+
+    def _reset_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.close()
+            except Exception:
+                pass
+        self._smtp = None
+
+    @staticmethod
+    def _is_transient_smtp_error(e: Exception) -> bool:
+        """Errores de conexión tras los que vale la pena reconectar y reintentar el envío."""
+        if isinstance(e, smtplib.SMTPServerDisconnected):
+            return True
+        # 421: el servidor cierra la sesión (p. ej. conexión inactiva demasiado tiempo)
+        if isinstance(e, smtplib.SMTPResponseException):
+            return e.smtp_code == 421
+        # El resto de errores SMTP (autenticación, destinatario rechazado) no se arreglan reintentando
+        if isinstance(e, smtplib.SMTPException):
+            return False
+        # BrokenPipeError, ConnectionResetError, ssl.SSLError, timeouts
+        return isinstance(e, OSError)
+
+    def _send_mail(self, msg):
+        """Envía un email por la conexión abierta, reconectando si el servidor la cerró."""
+        for attempt in range(1, SMTP_MAX_ATTEMPTS + 1):
+            try:
+                if self._smtp is None:
+                    self._smtp = self._smtp_connect()
+                self._smtp.send_message(msg)
+                return
+            except Exception as e:
+                self._reset_smtp()
+                if not self._is_transient_smtp_error(e):
+                    logger.error("No se pudo enviar el email a %s: %r", msg["To"], e)
+                    return
+                logger.warning(
+                    "Fallo de conexión SMTP enviando a %s (intento %d/%d): %r",
+                    msg["To"], attempt, SMTP_MAX_ATTEMPTS, e
+                )
+                if attempt < SMTP_MAX_ATTEMPTS:
+                    time.sleep(attempt)
+        logger.error("No se pudo enviar el email a %s tras %d intentos", msg["To"], SMTP_MAX_ATTEMPTS)
+
+    def _mail_worker(self):
+        # Abrir la conexión de antemano para que el primer envío no pague el handshake
+        if os.getenv("EMAIL"):
+            try:
+                self._smtp = self._smtp_connect()
+            except Exception as e:
+                self._smtp = None
+                logger.warning("No se pudo abrir la conexión SMTP; se reintentará al enviar: %s", e)
+        while True:
+            msgs = [self._mail_q.get()]
+            # Enviar todos los emails pendientes por la misma conexión
+            while True:
+                try:
+                    msgs.append(self._mail_q.get_nowait())
+                except queue.Empty:
+                    break
+            for msg in msgs:
+                self._send_mail(msg)
+
+    def _today(self) -> datetime.date:
+        """Fecha actual, recalculada solo cuando cambia el día."""
+        now = time.time()
+        if now >= self._today_expires:
+            self._today_date = datetime.date.today()
+            midnight = datetime.datetime.combine(
+                self._today_date + datetime.timedelta(days=1), datetime.time()
+            )
+            self._today_expires = midnight.timestamp()
+        return self._today_date
+
+    def _days_since(self, days_since: int) -> int:
+        """Días desde la compra, ajustando days_since por los días transcurridos desde el init."""
+        return int(days_since) + (self._today() - self._days_base_date).days
     
     def evaluate_return_eligibility(self, order_id: str) -> str:
         """
@@ -37,69 +221,26 @@ class Tools:
         """
         order_id = order_id.upper().strip()
         
-        # Filtramos el pedido correspondiente
-        pedido = self.df[self.df["order_id"] == order_id]
+        # Buscamos el pedido correspondiente
+        pedido = self._by_order.get(order_id)
         
-        if pedido.empty:
+        if pedido is None:
             return f"❌ No se encontró el pedido {order_id} en el sistema."
         
-        pedido = pedido.iloc[0]
-        
-        # 1. Verificar estado del pedido
-        estado = pedido["estado"]
-        if estado == "devuelto":
-            return f"❌ El pedido {order_id} ya fue devuelto anteriormente."
-        
-        if estado == "sin enviar":
-            return f"⚠️ El pedido {order_id} aún no ha sido enviado. Puedes cancelarlo sin iniciar una devolución."
-        
-        if estado == "enviado":
-            return f"⚠️ El pedido {order_id} está en tránsito. Espera a recibirlo para iniciar una devolución si es necesario."
-        
-        # 2. Categoría no elegible para devolución
-        categoria = pedido["category"]
-        categorias_no_devolucion = ["higiene", "software", "tarjetas de regalo"]
-        
-        if categoria in categorias_no_devolucion:
-            return (
-                f"❌ El producto '{pedido['product']}' pertenece a la categoría '{categoria}', "
-                f"que no admite devoluciones por política de la tienda."
-            )
-        
-        # 3. Días desde la compra
-        order_date = pedido["order_date"].date()
-        days_since_order = (datetime.date.today() - order_date).days
-        
-        if days_since_order > 30:
-            return (
-                f"❌ Han pasado {days_since_order} días desde la compra (fecha: {order_date}). "
-                f"Solo se admiten devoluciones dentro de 30 días."
-            )
-        
-        # 4. Productos personalizados requieren revisión
-        if categoria == "personalizado":
-            return (
-                f"⚠️ El producto '{pedido['product']}' es personalizado. "
-                f"La devolución requiere revisión manual del equipo. "
-                f"Tiempo desde compra: {days_since_order} días."
-            )
-        
-        # 5. Método de pago efectivo requiere revisión
-        payment_method = str(pedido["payment_method"]).lower()
-        if payment_method == "efectivo":
-            return (
-                f"✅ Pedido {order_id} elegible para devolución, pero requiere revisión manual "
-                f"por haber sido pagado en efectivo. Producto: '{pedido['product']}'. "
-                f"Tiempo desde compra: {days_since_order} días."
-            )
-        
-        # 6. Elegible sin restricciones
-        return (
-            f"✅ El pedido {order_id} con producto '{pedido['product']}' "
-            f"es elegible para devolución. "
-            f"Tiempo desde compra: {days_since_order} días. "
-            f"Método de pago: {pedido['payment_method']}. "
-            f"Total a reembolsar: ${pedido['price'] * pedido['quantity']:,.0f} COP."
+        code = int(pedido["elig_code"])
+        days_since_order = self._days_since(pedido["days_since"])
+        # El código se calculó con los días al init: un pedido puede haber superado el plazo desde entonces
+        if code > ELIG_FUERA_DE_PLAZO and days_since_order > 30:
+            code = ELIG_FUERA_DE_PLAZO
+        
+        return ELIGIBILITY_TEMPLATES[code].format(
+            order_id=order_id,
+            product=pedido["product"],
+            category=pedido["category"],
+            days=days_since_order,
+            order_date=pedido["order_date"].date(),
+            payment_method=pedido["payment_method"],
+            total=pedido["total"],
         )
     
     def search_customer_orders(self, customer_id: str) -> str:
@@ -114,26 +255,27 @@ class Tools:
         """
         customer_id = customer_id.upper().strip()
         
-        pedidos = self.df[self.df["customer_id"] == customer_id]
+        idxs = self._by_customer.get(customer_id)
         
-        if pedidos.empty:
+        if idxs is None:
             return f"❌ No se encontraron pedidos para el cliente {customer_id}."
         
-        result = f"📦 Pedidos del cliente {customer_id}:\n\n"
+        pedidos = self.df.iloc[idxs]
         
-        for _, pedido in pedidos.iterrows():
-            days_ago = (datetime.date.today() - pedido["order_date"].date()).days
-            total = pedido["price"] * pedido["quantity"]
+        parts = [f"📦 Pedidos del cliente {customer_id}:\n\n"]
+        
+        for pedido in pedidos.itertuples(index=False):
+            days_ago = self._days_since(pedido.days_since)
             
-            result += (
-                f"• Order ID: {pedido['order_id']}\n"
-                f"  Producto: {pedido['product']}\n"
-                f"  Estado: {pedido['estado']}\n"
-                f"  Total: ${total:,.0f} COP\n"
-                f"  Fecha: {pedido['order_date'].date()} (hace {days_ago} días)\n\n"
+            parts.append(
+                f"• Order ID: {pedido.order_id}\n"
+                f"  Producto: {pedido.product}\n"
+                f"  Estado: {pedido.estado}\n"
+                f"  Total: ${pedido.total:,.0f} COP\n"
+                f"  Fecha: {pedido.order_date.date()} (hace {days_ago} días)\n\n"
             )
         
-        return result
+        return "".join(parts)
     
     def initiate_return_request(self, order_id: str, customer_email: str, reason: str) -> str:
         """
@@ -147,39 +289,32 @@ class Tools:
         Returns:
             Confirmación del envío del email o mensaje de error.
         """
-        import smtplib
-        from email.mime.text import MIMEText
-        from email.mime.multipart import MIMEMultipart
-        
         order_id = order_id.upper().strip()
         
         # Verificar que el pedido existe
-        pedido = self.df[self.df["order_id"] == order_id]
+        pedido = self._by_order.get(order_id)
         
-        if pedido.empty:
+        if pedido is None:
             return f"❌ No se encontró el pedido {order_id} en el sistema."
         
-        pedido = pedido.iloc[0]
-        
         # Verificar elegibilidad básica antes de enviar email
         estado = pedido["estado"]
         if estado != "recibido":
             return f"❌ El pedido {order_id} no está en estado 'recibido'. Estado actual: {estado}. No se puede iniciar devolución."
         
         categoria = pedido["category"]
-        categorias_no_devolucion = ["higiene", "software", "tarjetas de regalo"]
         
-        if categoria in categorias_no_devolucion:
+        if categoria in CATEGORIAS_NO_DEVOLUCION:
             return f"❌ El producto pertenece a la categoría '{categoria}' que no admite devoluciones."
         
         order_date = pedido["order_date"].date()
-        days_since_order = (datetime.date.today() - order_date).days
+        days_since_order = self._days_since(pedido["days_since"])
         
         if days_since_order > 30:
             return f"❌ Han pasado {days_since_order} días desde la compra. Fuera del plazo de 30 días."
         
         # Preparar datos del email
-        total = pedido["price"] * pedido["quantity"]
+        total = pedido["total"]
         
         # Configuración SMTP de Gmail 
         # Para usar esta función, necesitas:
@@ -190,7 +325,6 @@ class Tools:
         try:
             # Email de la tienda (configurar según tu email)
             sender_email = os.getenv("EMAIL")
-            sender_password = os.getenv("PASSWORD")  
             
             # Crear mensaje
             msg = MIMEMultipart('alternative')
@@ -246,32 +380,26 @@ class Tools:
             # Adjuntar HTML al mensaje
             msg.attach(MIMEText(html_body, 'html'))
             
-            # Enviar email usando Gmail SMTP
+            # Encolar el email; el hilo de envío lo manda por la conexión Gmail SMTP abierta
             # NOTA: Para producción, considera usar servicios como SendGrid, Mailgun o Amazon SES
-            with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-                server.login(sender_email, sender_password)
-                server.send_message(msg)
+            self._mail_q.put(msg)
             
             return (
                 f"✅ Solicitud de devolución iniciada exitosamente!\n\n"
-                f"📧 Se ha enviado un email de confirmación a: {customer_email}\n"
+                f"📧 Se enviará un email de confirmación a: {customer_email}\n"
                 f"📦 Pedido: {order_id}\n"
                 f"🛍️ Producto: {pedido['product']}\n"
                 f"💰 Monto a reembolsar: ${total:,.0f} COP\n\n"
                 f"Nuestro equipo revisará tu solicitud en 24-48 horas."
             )
             
-        except smtplib.SMTPAuthenticationError:
-            return (
-                "⚠️ Error de autenticación de email. "
-                "La solicitud fue registrada pero no se pudo enviar el email de confirmación. "
-                "Nuestro equipo se pondrá en contacto contigo."
-            )
         except Exception as e:
+            # El envío ocurre en el hilo de correo: aquí solo puede fallar la preparación del
+            # email, antes de encolarlo, así que la solicitud no quedó registrada
+            logger.exception("No se pudo preparar el email de devolución del pedido %s", order_id)
             return (
-                f"⚠️ La solicitud fue registrada pero hubo un problema al enviar el email: {str(e)}\n"
-                f"Pedido {order_id} marcado para revisión. "
-                f"Te contactaremos a {customer_email} en las próximas horas."
+                f"❌ No se pudo registrar la solicitud de devolución del pedido {order_id}: {str(e)}\n"
+                f"Por favor intenta de nuevo en unos minutos."
             )
     
     # === ENVOLVER EN FUNCTIONTOOL ===